@@ -1,8 +1,13 @@
+import json
 import logging
 import os
-from typing import Optional
+import sys
+from functools import partial
+from typing import Callable, Optional
 
 from dotenv import load_dotenv
+from grpc import Compression
+import orjson
 import prometheus_client
 import structlog
 from fastapi import FastAPI
@@ -30,12 +35,52 @@ load_dotenv()
 OTEL_BACKEND_ENDPOINT = os.getenv("OTEL_BACKEND_ENDPOINT", "http://localhost:4317")
 OBSERVABILITY_BACKEND = os.getenv("OBSERVABILITY_BACKEND", "signoz")
 LOKI_BACKEND_ENDPOINT = os.getenv("LOKI_BACKEND_ENDPOINT", "http://localhost:3100")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# the request middleware already records method, path and duration, auto-instrumentation is opt-in to avoid
+# instrumenting each request twice
+ENABLE_OTEL_FASTAPI_INSTRUMENT = os.getenv("ENABLE_OTEL_FASTAPI_INSTRUMENT", "false") == "true"
+
+
+def tuned_default(value, *env_vars):
+    """Returns the tuned value if none of the given standard SDK env vars are set, else None to let the SDK parse and
+    validate the env vars itself."""
+
+    return None if any(env_var in os.environ for env_var in env_vars) else value
+
+
+# batch exporter tuning, larger and less frequent batches keep OTLP exports off the request path under load. These
+# only replace the SDK defaults, the batch size is left to the SDK when the queue size is configured so it never
+# exceeds the queue size
+BSP_MAX_QUEUE_SIZE = tuned_default(8192, "OTEL_BSP_MAX_QUEUE_SIZE")
+BSP_MAX_EXPORT_BATCH_SIZE = tuned_default(1024, "OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "OTEL_BSP_MAX_QUEUE_SIZE")
+BSP_SCHEDULE_DELAY_MILLIS = tuned_default(2000, "OTEL_BSP_SCHEDULE_DELAY")
+BLRP_MAX_QUEUE_SIZE = tuned_default(8192, "OTEL_BLRP_MAX_QUEUE_SIZE")
+BLRP_MAX_EXPORT_BATCH_SIZE = tuned_default(1024, "OTEL_BLRP_MAX_EXPORT_BATCH_SIZE", "OTEL_BLRP_MAX_QUEUE_SIZE")
+BLRP_SCHEDULE_DELAY_MILLIS = tuned_default(2000, "OTEL_BLRP_SCHEDULE_DELAY")
+METRIC_EXPORT_INTERVAL_MILLIS = tuned_default(5000, "OTEL_METRIC_EXPORT_INTERVAL")
+
+OTLP_CHANNEL_OPTIONS = (("grpc.max_send_message_length", 16 << 20),)
+
+
+def otlp_exporter_options(signal: str) -> dict:
+    """Returns the OTLP exporter arguments for the given signal, one of 'TRACES', 'LOGS' or 'METRICS'.
+
+    Payloads are gzip compressed on the wire by default, as repetitive attribute sets shrink considerably. When the
+    generic or the signal's own standard compression env var is set, the exporter resolves compression from it itself.
+    Exporters do not accept an existing channel, but gRPC shares one connection between channels created with the same
+    target, credentials and options through its global subchannel pool, so signals left on the defaults are
+    multiplexed over a single HTTP/2 connection."""
+
+    compression = tuned_default(
+        Compression.Gzip, "OTEL_EXPORTER_OTLP_COMPRESSION", f"OTEL_EXPORTER_OTLP_{signal}_COMPRESSION"
+    )
+    return {"endpoint": OTEL_BACKEND_ENDPOINT, "compression": compression, "channel_options": OTLP_CHANNEL_OPTIONS}
 
 
 # ---- Logging -----
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     # use otel-friendly formatting
     format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
 )
@@ -48,22 +93,35 @@ def register_otel_ids(_, __, event_dict):
     context = span.get_span_context()
     if span.is_recording():
         # ensure trace and span IDs are in same format as in UI
-        event_dict["trace_id"] = format(context.trace_id, "032x")
-        event_dict["span_id"] = format(context.span_id, "016x")
+        event_dict["trace_id"] = f"{context.trace_id:032x}"
+        event_dict["span_id"] = f"{context.span_id:016x}"
     return event_dict
 
 
+def orjson_dumps(value, **kwargs) -> str:
+    """Serializes log events with orjson, decoding the output as stdlib loggers expect string messages. Falls back to
+    the stdlib encoder for values orjson rejects, such as integers beyond 64 bits, so logging never raises."""
+
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS, **kwargs).decode()
+    except TypeError:
+        return json.dumps(value, **kwargs)
+
+
 structlog_processors = [
     structlog.contextvars.merge_contextvars,
     structlog.processors.TimeStamper(fmt="ISO"),
     structlog.processors.add_log_level,
     structlog.processors.StackInfoRenderer(),
     structlog.processors.format_exc_info,
-    register_otel_ids,
 ]
 # TODO: this ensures loki handler doesn't double encode the JSON log message, this is not ideal
 if OBSERVABILITY_BACKEND == "signoz":
-    structlog_processors.append(structlog.processors.JSONRenderer())
+    # request spans are only recorded for signoz with FastAPI instrumentation enabled, spans are never recording
+    # otherwise
+    if ENABLE_OTEL_FASTAPI_INSTRUMENT:
+        structlog_processors.append(register_otel_ids)
+    structlog_processors.append(structlog.processors.JSONRenderer(serializer=orjson_dumps))
 else:
     structlog_processors.append(structlog.processors.LogfmtRenderer())
 
@@ -90,6 +148,9 @@ counter = None
 histogram = None
 gauge = None
 
+# instrument update callables bound to each (method, path) label combination, see `get_labeled`
+_label_cache: dict[tuple[str, str], tuple[Callable, Callable, Callable]] = {}
+
 
 def setup_telemetry():
     """Sets up telemetry for the application, including tracing, logging, and metrics based on observability backend
@@ -116,16 +177,22 @@ def setup_telemetry():
 
 def setup_tracing(resource: Resource) -> Optional[TracerProvider]:
     """Setup tracing within the application context to ensure reliable trace and span capture within FastAPI context, and to
-    add the context to the logger for further distributed tracing. This is necessary else we do not see trace and span
-    ID values in the middleware."""
+    add the context to the logger for further distributed tracing. Request spans, and thereby trace and span ID values
+    in the middleware logs, are only captured when FastAPI instrumentation is enabled via
+    `ENABLE_OTEL_FASTAPI_INSTRUMENT`."""
 
     if OBSERVABILITY_BACKEND != "signoz":
         return
 
     tracer_provider = TracerProvider(resource=resource)
 
-    span_exporter = OTLPSpanExporter(endpoint=OTEL_BACKEND_ENDPOINT)
-    span_processor = BatchSpanProcessor(span_exporter)
+    span_exporter = OTLPSpanExporter(**otlp_exporter_options("TRACES"))
+    span_processor = BatchSpanProcessor(
+        span_exporter,
+        max_queue_size=BSP_MAX_QUEUE_SIZE,
+        schedule_delay_millis=BSP_SCHEDULE_DELAY_MILLIS,
+        max_export_batch_size=BSP_MAX_EXPORT_BATCH_SIZE,
+    )
     tracer_provider.add_span_processor(span_processor)
 
     trace.set_tracer_provider(tracer_provider)
@@ -144,8 +211,13 @@ def setup_logging(resource: Resource):
     logger_provider = LoggerProvider(resource=resource)
     set_logger_provider(logger_provider)
 
-    logger_exporter = OTLPLogExporter(endpoint=OTEL_BACKEND_ENDPOINT)
-    logger_processor = BatchLogRecordProcessor(logger_exporter)
+    logger_exporter = OTLPLogExporter(**otlp_exporter_options("LOGS"))
+    logger_processor = BatchLogRecordProcessor(
+        logger_exporter,
+        max_queue_size=BLRP_MAX_QUEUE_SIZE,
+        schedule_delay_millis=BLRP_SCHEDULE_DELAY_MILLIS,
+        max_export_batch_size=BLRP_MAX_EXPORT_BATCH_SIZE,
+    )
     logger_provider.add_log_record_processor(logger_processor)
 
     logging.getLogger().addHandler(LoggingHandler(logger_provider=logger_provider))
@@ -180,8 +252,10 @@ def setup_metrics(resource: Resource) -> tuple[Optional[MeterProvider], tuple]:
         logger.debug("configured Prometheus native metrics")
         return None, (counter, histogram, gauge)
 
-    metric_exporter = OTLPMetricExporter(endpoint=OTEL_BACKEND_ENDPOINT)
-    otel_metric_reader = PeriodicExportingMetricReader(metric_exporter)
+    metric_exporter = OTLPMetricExporter(**otlp_exporter_options("METRICS"))
+    otel_metric_reader = PeriodicExportingMetricReader(
+        metric_exporter, export_interval_millis=METRIC_EXPORT_INTERVAL_MILLIS
+    )
 
     meter_provider = MeterProvider(resource=resource, metric_readers=[otel_metric_reader])
     metrics.set_meter_provider(meter_provider)
@@ -207,38 +281,49 @@ def setup_metrics(resource: Resource) -> tuple[Optional[MeterProvider], tuple]:
     return meter_provider, (counter, histogram, gauge)
 
 
-def increment_counter(amount, attributes):
-    """Increment the counter by the specified amount."""
-
-    global counter
-    if OBSERVABILITY_BACKEND == "signoz":
-        counter.add(amount, attributes)
-    else:
-        counter.labels(**attributes).inc(amount)
-
+def get_labeled(method: str, path: str) -> tuple[Callable, Callable, Callable]:
+    """Returns the counter increment, histogram observe and gauge set callables bound to the method and path labels.
+    These are resolved once per label combination and cached, keeping label lookups off the request path."""
 
-def record_histogram(value, attributes):
-    """Record a value in the histogram."""
+    key = (method, path)
+    labeled = _label_cache.get(key)
+    if labeled is not None:
+        return labeled
 
-    global histogram
+    method, path = sys.intern(method), sys.intern(path)
     if OBSERVABILITY_BACKEND == "signoz":
-        histogram.record(value, attributes)
+        attributes = {"method": method, "path": path}
+        labeled = (
+            partial(counter.add, attributes=attributes),
+            partial(histogram.record, attributes=attributes),
+            partial(gauge.set, attributes=attributes),
+        )
     else:
-        histogram.labels(**attributes).observe(value)
+        labeled = (
+            counter.labels(method=method, path=path).inc,
+            histogram.labels(method=method, path=path).observe,
+            gauge.labels(method=method, path=path).set,
+        )
 
+    _label_cache[(method, path)] = labeled
+    return labeled
 
-def set_gauge(value, attributes):
-    """Set the gauge to the specified value."""
 
-    global gauge
-    if OBSERVABILITY_BACKEND == "signoz":
-        gauge.set(value, attributes)
-    else:
-        gauge.labels(**attributes).set(value)
+def record(method: str, path: str, process_time: float, active_users: int):
+    """Records a processed request, updating the request counter, duration histogram and active users gauge in a
+    single call."""
+
+    increment_counter, record_histogram, set_gauge = get_labeled(method, path)
+    increment_counter(1)
+    record_histogram(process_time)
+    set_gauge(active_users)
 
 
 def instrument_fastapi(app: FastAPI):
-    """Instruments FastAPI app instance exactly once."""
+    """Instruments FastAPI app instance exactly once, if enabled."""
+
+    if not ENABLE_OTEL_FASTAPI_INSTRUMENT:
+        return app
 
     # this is the same approach used by `instrument_app` method internally, to avoid multiple instrumentation attempts
     if not getattr(app, "_is_instrumented_by_opentelemetry", False):
@@ -1,11 +1,18 @@
+import asyncio
+import logging
 import time
-from typing import Awaitable
+from typing import AsyncIterator, Iterator
 
 import structlog
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.exceptions import HTTPException
-from fastapi.responses import Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import CollectorRegistry
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app import config
 
@@ -14,57 +21,119 @@ logger = structlog.get_logger()
 
 app = FastAPI()
 config.instrument_fastapi(app)
+# Prometheus scrapes advertise gzip support, the repetitive exposition text compresses well
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+UNMATCHED_ROUTE_PATH = "unmatched"
+# constant payload for the hottest endpoint, serialized once instead of per request
+FAST_RESPONSE_BODY = b'{"message":"fast_response"}'
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request metrics and adding the X-Process-Time response header. Avoids the task
+    group and memory stream `BaseHTTPMiddleware` sets up for each request. The active users count is local to the
+    middleware instance, and thereby to the worker."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.active_users = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.active_users += 1
+
+        # skip building and processing the log event entirely when debug logs are disabled
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            logger.debug("Request received", method=scope["method"], path=scope["path"])
+        start_ns = time.monotonic_ns()
+
+        status_code = None
+        process_time = None
+        request_finished = False
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, process_time, request_finished
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = (time.monotonic_ns() - start_ns) * 1e-9
+                MutableHeaders(scope=message).append("X-Process-Time", f"{process_time:.2f}")
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # record before forwarding the final body message, while the request's server span is still active
+                # for trace and span IDs to be attached to the log
+                request_finished = True
+                self.active_users -= 1
+                if process_time is not None:
+                    self.record_request(scope, process_time, status_code, debug_enabled)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # we are considering each user to be active only for the duration of the request
+            if not request_finished:
+                self.active_users -= 1
+
+    def record_request(self, scope: Scope, process_time: float, status_code: int, debug_enabled: bool):
+        """Records metrics for the processed request and logs it if debug logs are enabled."""
+
+        # label metrics with the matched route template rather than the raw path to keep label cardinality bounded,
+        # requests not matching any route are grouped together
+        route = scope.get("route")
+        path = getattr(route, "path_format", UNMATCHED_ROUTE_PATH)
+        config.record(scope["method"], path, process_time, self.active_users)
+
+        if debug_enabled:
+            logger.debug(
+                "Request processed",
+                process_time=f"{process_time:2f}",
+                method=scope["method"],
+                path=scope["path"],
+                status_code=status_code,
+            )
+
+
+app.add_middleware(MetricsMiddleware)
 
-active_users = 0
 
+@app.get("/fast")
+async def fast_response():
+    return Response(content=FAST_RESPONSE_BODY, media_type="application/json")
 
-@app.middleware("http")
-async def handle_incoming_requests(request: Request, call_next: Awaitable):
-    route_attrs = {"method": request.method, "path": request.url.path}
-
-    global active_users
-    active_users += 1
-    config.set_gauge(active_users, route_attrs)
-
-    logger.debug("Request received", **route_attrs)
-    start_time = time.perf_counter()
-
-    response = await call_next(request)
 
-    process_time = time.perf_counter() - start_time
-    response.headers["X-Process-Time"] = f"{process_time:.2f}"
+@app.get("/slow")
+async def slow_response():
+    await asyncio.sleep(2)
+    return {"message": "slow_response"}
 
-    config.increment_counter(1, route_attrs)
-    config.record_histogram(process_time, route_attrs)
 
-    # we are considering each user to be active only for the duration of the request
-    active_users -= 1
-    config.set_gauge(active_users, route_attrs)
+@app.get("/error")
+def error_response():
+    logger.error("Mocking an application error")
+    # same payload FastAPI renders for an HTTPException, without raising and handling one
+    return JSONResponse(status_code=500, content={"detail": "error_response"})
 
-    logger.debug(
-        "Request processed",
-        process_time=f"{process_time:2f}",
-        **route_attrs,
-        status_code=response.status_code,
-    )
-    return response
 
+class MetricFamilyCollector:
+    """Collector exposing a single, already collected metric family, letting `generate_latest` render it alone."""
 
-@app.get("/fast")
-def fast_response():
-    return {"message": "fast_response"}
+    def __init__(self, metric: Metric):
+        self.metric = metric
 
+    def collect(self) -> Iterator[Metric]:
+        yield self.metric
 
-@app.get("/slow")
-def slow_response():
-    time.sleep(2)
-    return {"message": "slow_response"}
 
+async def iter_metrics(registry: CollectorRegistry) -> AsyncIterator[bytes]:
+    """Yields the registry's exposition output one metric family at a time, avoiding building the whole payload in
+    memory before responding. Async so that families are yielded on the event loop, rather than each taking a
+    threadpool round-trip."""
 
-@app.get("/error")
-def error_response():
-    logger.error("Mocking an application error")
-    raise HTTPException(status_code=500, detail="error_response")
+    for metric in registry.collect():
+        yield generate_latest(MetricFamilyCollector(metric))
 
 
 @app.get("/metrics")
@@ -75,4 +144,4 @@ def metrics():
     if not registry:
         return HTTPException(status_code=400, detail="Prometheus observability platform not configured")
 
-    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return StreamingResponse(iter_metrics(registry), media_type=CONTENT_TYPE_LATEST)